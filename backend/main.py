@@ -4,16 +4,52 @@ from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+import orjson
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from duckduckgo_search import DDGS
-import requests
+import httpx
+from dataclasses import dataclass, field, fields
+from urllib.parse import urlsplit
 from bs4 import BeautifulSoup
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple
 import logging
 
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Semantic caching is disabled without sentence-transformers
+    SentenceTransformer = None
+
+try:
+    # The lexbor backend; selectolax 1.0 removed the Modest one behind selectolax.parser
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:  # Fall back to BeautifulSoup's built-in parser without selectolax
+    HTMLParser = None
+
+try:
+    import h2  # noqa: F401  # Enables HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import diskcache
+except ImportError:  # Scraped pages are not cached without diskcache
+    diskcache = None
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+if HTMLParser is None:
+    logger.warning(
+        "selectolax lexbor parser unavailable, scraping falls back to BeautifulSoup html.parser"
+    )
+
 
 load_dotenv()
 # Load environment variables
@@ -31,13 +67,233 @@ def health_check_new():
     return {"status": "ok"}
 
 
+# One async client for every Groq call so concurrent requests multiplex over a
+# single HTTP/2 connection instead of each opening its own
+_GROQ_HTTP_CLIENT = httpx.AsyncClient(
+    http2=HTTP2_AVAILABLE,
+    limits=httpx.Limits(max_keepalive_connections=32),
+)
+
 llm = ChatGroq(
     api_key=GROQ_API_KEY,
     model="llama-3.1-8b-instant",
     temperature=0,
     max_tokens=1000,
+    http_async_client=_GROQ_HTTP_CLIENT,
 )
 
+# Model for plain chat messages that carry no search results; point
+# GROQ_NO_SEARCH_MODEL at a smaller Groq model to route them to a cheaper tier
+no_search_llm = ChatGroq(
+    api_key=GROQ_API_KEY,
+    model=os.getenv("GROQ_NO_SEARCH_MODEL", "llama-3.1-8b-instant"),
+    temperature=0,
+    max_tokens=1000,
+    http_async_client=_GROQ_HTTP_CLIENT,
+)
+
+RESPONSE_CACHE_SIZE = 1024  # Maximum number of cached LLM responses
+
+# LRU cache of generated responses keyed by a hash of the message and search results
+_RESPONSE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+# LRU cache of responses to messages sent without search, keyed by the normalised message
+_NO_SEARCH_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def response_cache_key(message: str, search_results: Dict) -> str:
+    """Build the exact-match cache key for a message and its search results.
+
+    Args:
+        message (str): The user message.
+        search_results (Dict): The search results supplied to the prompt.
+
+    Returns:
+        str: A hex digest identifying the prompt inputs.
+    """
+    payload = orjson.dumps(search_results or {}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(message.encode() + b"|" + payload).hexdigest()
+
+
+def no_search_cache_key(message: str) -> str:
+    """Normalise a message into its key in the no-search cache."""
+    return " ".join(message.lower().split())
+
+
+def get_cached_response(
+    key: str, cache: "OrderedDict[str, str]" = _RESPONSE_CACHE
+) -> Optional[str]:
+    """Return the cached response for the key, if any, marking it as recently used."""
+    with _RESPONSE_CACHE_LOCK:
+        response = cache.get(key)
+        if response is not None:
+            cache.move_to_end(key)
+        return response
+
+
+def set_cached_response(
+    key: str, response: str, cache: "OrderedDict[str, str]" = _RESPONSE_CACHE
+) -> None:
+    """Store a response in the cache, evicting the least recently used entry when full."""
+    with _RESPONSE_CACHE_LOCK:
+        cache[key] = response
+        cache.move_to_end(key)
+        if len(cache) > RESPONSE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.90  # Minimum cosine similarity to reuse a response
+SEMANTIC_CACHE_SIZE = 1024  # Maximum number of cached embeddings
+
+# Normalised embeddings of messages sent without search, with their responses. Search
+# answers are never reused semantically since they depend on the fresh results.
+_SEMANTIC_EMBEDDINGS: Optional[np.ndarray] = None
+_SEMANTIC_RESPONSES: List[str] = []
+_SEMANTIC_CACHE_LOCK = threading.Lock()
+_EMBEDDER = None
+_EMBEDDER_LOCK = threading.Lock()
+
+
+def embed_message(message: str) -> Optional[np.ndarray]:
+    """Embed a message for semantic cache lookups.
+
+    Args:
+        message (str): The user message to embed.
+
+    Returns:
+        Optional[np.ndarray]: The unit-normalised embedding, or None if semantic caching is unavailable.
+    """
+    global _EMBEDDER
+    if SentenceTransformer is None:
+        return None
+    try:
+        # Loading may download the model, so it gets its own lock rather than
+        # holding up cache lookups
+        if _EMBEDDER is None:
+            with _EMBEDDER_LOCK:
+                if _EMBEDDER is None:
+                    _EMBEDDER = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        return _EMBEDDER.encode(message, normalize_embeddings=True).astype(np.float32)
+    except Exception as e:
+        logger.error(f"Error embedding message for semantic cache: {e}")
+        return None
+
+
+def get_semantic_cached_response(embedding: np.ndarray) -> Optional[str]:
+    """Return the response of the most similar cached message if it clears the threshold."""
+    with _SEMANTIC_CACHE_LOCK:
+        if _SEMANTIC_EMBEDDINGS is None or not len(_SEMANTIC_EMBEDDINGS):
+            return None
+        # Embeddings are unit-normalised, so the dot product is the cosine similarity
+        sims = _SEMANTIC_EMBEDDINGS @ embedding
+        best = int(sims.argmax())
+        if sims[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return _SEMANTIC_RESPONSES[best]
+        return None
+
+
+def set_semantic_cached_response(embedding: np.ndarray, response: str) -> None:
+    """Store a message embedding and its response, dropping the oldest entry when full."""
+    global _SEMANTIC_EMBEDDINGS
+    with _SEMANTIC_CACHE_LOCK:
+        if _SEMANTIC_EMBEDDINGS is None:
+            embeddings = embedding[np.newaxis, :]
+        else:
+            embeddings = np.vstack([_SEMANTIC_EMBEDDINGS, embedding])
+        _SEMANTIC_RESPONSES.append(response)
+        if len(_SEMANTIC_RESPONSES) > SEMANTIC_CACHE_SIZE:
+            embeddings = embeddings[1:]
+            del _SEMANTIC_RESPONSES[0]
+        _SEMANTIC_EMBEDDINGS = embeddings
+
+
+def drop_semantic_cached_responses(embedding: np.ndarray) -> None:
+    """Drop every cached message similar enough to the embedding to be reused for it."""
+    global _SEMANTIC_EMBEDDINGS
+    with _SEMANTIC_CACHE_LOCK:
+        if _SEMANTIC_EMBEDDINGS is None or not len(_SEMANTIC_EMBEDDINGS):
+            return
+        keep = (_SEMANTIC_EMBEDDINGS @ embedding) < SEMANTIC_CACHE_THRESHOLD
+        _SEMANTIC_EMBEDDINGS = _SEMANTIC_EMBEDDINGS[keep]
+        _SEMANTIC_RESPONSES[:] = [
+            response for response, kept in zip(_SEMANTIC_RESPONSES, keep) if kept
+        ]
+
+
+def invalidate_no_search_response(message: str) -> None:
+    """Drop the no-search responses for a message once the user asks it with search.
+
+    Both the exact entry and any semantic entries that would match the message are
+    dropped, so the invalidated answer cannot come back through the semantic layer.
+    """
+    with _RESPONSE_CACHE_LOCK:
+        _NO_SEARCH_CACHE.pop(no_search_cache_key(message), None)
+
+    # Nothing to embed against if the semantic cache is empty
+    if _SEMANTIC_EMBEDDINGS is None or not len(_SEMANTIC_EMBEDDINGS):
+        return
+    embedding = embed_message(message)
+    if embedding is not None:
+        drop_semantic_cached_responses(embedding)
+
+
+UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+# Shared client so repeat scrapes reuse pooled TCP/TLS connections, multiplexing
+# scrapes of the same host over one HTTP/2 connection where the site supports it
+_HTTPX = httpx.Client(
+    timeout=3.0,
+    follow_redirects=True,
+    headers={"User-Agent": UA},
+    transport=httpx.HTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        retries=1,
+        limits=httpx.Limits(max_keepalive_connections=64, max_connections=128),
+    ),
+)
+
+
+@dataclass(slots=True)
+class SearchHit:
+    """A web or news search result, with the scraped page content once fetched."""
+
+    url: str
+    title: str
+    body: str
+    content: str = ""
+    date: Optional[str] = None
+    image: Optional[str] = None
+    source: Optional[str] = None
+
+
+@dataclass(slots=True)
+class VideoHit:
+    """A YouTube video search result."""
+
+    id: str
+    title: str
+    link: str
+    source: str
+    thumbnails: List[str] = field(default_factory=list)
+    description: Optional[str] = None
+    channel: str = "YouTube"
+    publish_time: Optional[str] = None
+
+
+MAX_CONTENT_CHARS = 2000  # Maximum characters of scraped content to keep per page
+CONTENT_TAGS = ("p", "h1", "h2", "h3", "li")  # Elements that carry readable page text
+CONTENT_SELECTOR = ", ".join(CONTENT_TAGS)
+
+SCRAPE_CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR", "/tmp/scrape")
+SCRAPE_CACHE_TTL = 3600  # Seconds to keep scraped page content
+
+# On-disk cache of scraped content keyed by URL, shared across restarts and workers
+_SCRAPE_CACHE = diskcache.Cache(SCRAPE_CACHE_DIR) if diskcache is not None else None
+
 
 def is_garbled(text: str) -> bool:
     """Check if a given text contains a high proportion of non-ASCII characters.
@@ -48,10 +304,49 @@ def is_garbled(text: str) -> bool:
     Returns:
         bool: True if the text contains a high proportion of non-ASCII characters, False otherwise.
     """
-    non_ascii_count = sum(1 for char in text if ord(char) > 127)
+    # Dropping non-ASCII characters in the codec keeps the scan in C
+    non_ascii_count = len(text) - len(text.encode("ascii", "ignore"))
     return non_ascii_count > len(text) * 0.3
 
 
+def has_content_ancestor(node) -> bool:
+    """Check whether a selectolax node sits inside another content element."""
+    parent = node.parent
+    while parent is not None:
+        if parent.tag in CONTENT_TAGS:
+            return True
+        parent = parent.parent
+    return False
+
+
+def extract_text(html: bytes) -> str:
+    """Extract readable text from an HTML document.
+
+    Args:
+        html (bytes): The raw HTML document.
+
+    Returns:
+        str: The text of the document's content elements joined by spaces.
+    """
+    # A node's text already includes its descendants, so only content elements
+    # without a content ancestor are kept to avoid emitting nested text twice
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        texts = (
+            node.text(separator=" ", strip=True)
+            for node in tree.css(CONTENT_SELECTOR)
+            if not has_content_ancestor(node)
+        )
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+        texts = (
+            node.get_text(" ", strip=True)
+            for node in soup.select(CONTENT_SELECTOR)
+            if node.find_parent(list(CONTENT_TAGS)) is None
+        )
+    return " ".join(text for text in texts if text)
+
+
 def scrape_website(url: str) -> Dict[str, str]:
     """Scrape content from the given URL and return structured data.
 
@@ -61,14 +356,22 @@ def scrape_website(url: str) -> Dict[str, str]:
     Returns:
         Dict[str, str]: A dictionary containing the source URL and the scraped content.
     """
+    # Cache errors (e.g. a database locked by another worker) fall through to a fetch
+    if _SCRAPE_CACHE is not None:
+        try:
+            cached_content = _SCRAPE_CACHE.get(url)
+        except Exception as e:
+            logger.warning(f"Scrape cache read failed for URL {url}: {e}")
+            cached_content = None
+        if cached_content is not None:
+            return {"source": url, "content": cached_content}
+
     try:
-        response = requests.get(url, timeout=3)
+        response = _HTTPX.get(url)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
 
         # Extract text content
-        texts = soup.stripped_strings
-        content = " ".join(texts)
+        content = extract_text(response.content)
 
         # Check for garbled text
         if is_garbled(content):
@@ -76,19 +379,26 @@ def scrape_website(url: str) -> Dict[str, str]:
             return {"source": url, "content": ""}
 
         # Trim content and ensure sentence boundary
-        trimmed_content = content[:2]
+        trimmed_content = content[:MAX_CONTENT_CHARS]
         last_sentence_end = trimmed_content.rfind(". ")
         if last_sentence_end != -1:
             content = trimmed_content[: last_sentence_end + 1]
         else:
             content = trimmed_content
 
+        # Only cache successful scrapes so transient failures are retried
+        if _SCRAPE_CACHE is not None and content:
+            try:
+                _SCRAPE_CACHE.set(url, content, expire=SCRAPE_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Scrape cache write failed for URL {url}: {e}")
+
         return {"source": url, "content": content}
 
-    except requests.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"HTTPError for URL {url}: {e}")
         return {"source": url, "content": ""}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"RequestException for URL {url}: {e}")
         return {"source": url, "content": ""}
     except Exception as e:
@@ -96,17 +406,50 @@ def scrape_website(url: str) -> Dict[str, str]:
         return {"source": url, "content": ""}
 
 
-def add_content_to_results(results: List[Dict], link: str = "link"):
+def scrape_website_once(
+    url: str, scraped: Optional[Dict[str, Future]] = None
+) -> Dict[str, str]:
+    """Scrape a URL at most once per request, sharing in-flight scrapes between callers.
+
+    Args:
+        url (str): The URL to scrape content from.
+        scraped (Optional[Dict[str, Future]]): Request-scoped map of URL to scrape result.
+
+    Returns:
+        Dict[str, str]: A dictionary containing the source URL and the scraped content.
     """
-    Add content to the results serially, stopping when valid content is found.
-    Limits results from the same domain to avoid redundancy.
+    if scraped is None:
+        return scrape_website(url)
+
+    # setdefault is atomic, so exactly one caller claims the URL and the rest wait on it
+    future = Future()
+    existing = scraped.setdefault(url, future)
+    if existing is not future:
+        return existing.result()
+
+    try:
+        content_data = scrape_website(url)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    future.set_result(content_data)
+    return content_data
+
+
+def add_content_to_results(
+    results: List[SearchHit],
+    scraped: Optional[Dict[str, Future]] = None,
+) -> List[SearchHit]:
+    """
+    Add content to the results by scraping their links in parallel, stopping once
+    enough valid content is found. Limits results from the same domain to avoid redundancy.
 
     Args:
-        results (List[Dict]): List of search results to process
-        link (str): Key name for the URL in result dictionaries
+        results (List[SearchHit]): List of search results to process
+        scraped (Optional[Dict[str, Future]]): Request-scoped map used to avoid scraping a URL twice
 
     Returns:
-        List[Dict]: Processed results with content added
+        List[SearchHit]: Processed results with content added, in their original order
     """
     MAX_RESULTS = 5  # Maximum results to process
     MAX_PER_DOMAIN = 1  # Maximum results per domain
@@ -120,81 +463,104 @@ def add_content_to_results(results: List[Dict], link: str = "link"):
     def extract_domain(url: str) -> str:
         """Extract the main domain from a URL."""
         try:
-            # Remove protocol (http:// or https://) and get domain
-            domain = url.split("//")[-1].split("/")[0]
+            # urlsplit needs the "//" to recognise the host of scheme-less URLs
+            hostname = urlsplit(url if "//" in url else f"//{url}").hostname
             # Remove 'www.' if present
-            if domain.startswith("www."):
-                domain = domain[4:]
-            return domain
+            return hostname.removeprefix("www.") if hostname else url
         except Exception:
             return url
 
-    for result in results_to_process:
-        url = result.get(f"{link}", "")
-        domain = extract_domain(url)
-
-        # Skip if we've already processed maximum allowed results from this domain
-        if domain_count.get(domain, 0) >= MAX_PER_DOMAIN:
-            continue
-
-        # Extract content from the result link
-        content_data = scrape_website(url)
-
-        # Add the content to the result
-        result["content"] = content_data.get("content", "")
-
-        # Only count this result if we got valid content
-        if result["content"].strip():
-            domain_count[domain] = domain_count.get(domain, 0) + 1
-            processed_results.append(result)
-            valid_content_count += 1
-
-            # Break if we've found enough valid content
-            if valid_content_count >= VALID_CONTENT_LIMIT:
-                break
-
-    return processed_results
-
+    if not results_to_process:
+        return processed_results
 
-def exract_search_results(results: List[Dict]) -> str:
-    """Extract search results from the given list of dictionaries."""
-
-    extracted_results = ""
-    for item in results:
-        for key, value in item.items():
-            extracted_results += f"{key}: {value}\n"
-
-    return extracted_results
+    executor = ThreadPoolExecutor(max_workers=len(results_to_process))
+    try:
+        # Submit every link at once, keyed back to its position in the input
+        futures = {
+            executor.submit(scrape_website_once, result.url, scraped): index
+            for index, result in enumerate(results_to_process)
+        }
+
+        for future in as_completed(futures):
+            index = futures[future]
+            result = results_to_process[index]
+            domain = extract_domain(result.url)
+
+            # Skip if we've already accepted maximum allowed results from this domain
+            if domain_count.get(domain, 0) >= MAX_PER_DOMAIN:
+                continue
+
+            # Add the content to the result
+            content_data = future.result()
+            result.content = content_data.get("content", "")
+
+            # Only count this result if we got valid content
+            if result.content.strip():
+                domain_count[domain] = domain_count.get(domain, 0) + 1
+                processed_results.append((index, result))
+                valid_content_count += 1
+
+                # Break if we've found enough valid content
+                if valid_content_count >= VALID_CONTENT_LIMIT:
+                    break
+    finally:
+        # Drop any scrapes still queued once we have enough content
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return [result for _, result in sorted(processed_results, key=lambda item: item[0])]
+
+
+def exract_search_results(results: List[Any]) -> str:
+    """Extract search results from the given list of search hits."""
+
+    return "".join(
+        f"{item_field.name}: {value}\n"
+        for item in results
+        for item_field in fields(item)
+        if (value := getattr(item, item_field.name)) is not None
+    )
 
 
-def search_duckduckgo_text(query: str, region: str = "wt-wt") -> List:
+def search_duckduckgo_text(
+    query: str, region: str = "wt-wt", scraped: Optional[Dict[str, Future]] = None
+) -> List[SearchHit]:
     """
     Search DuckDuckGo for results based on the given query.
 
     Args:
         query (str): The search query for DuckDuckGo.
         region(str): [Optional] : region for which to make query
+        scraped(Dict): [Optional] : request-scoped map of already scraped URLs
 
     Returns:
-        List: A list containing the status and either the search result or an error message.
+        List[SearchHit]: The search results with scraped content, or an empty list in case of an error.
         [
-            {
-                "title": "News, sport, celebrities and gossip | The Sun",
-                "href": "https://www.thesun.co.uk/",
-                "body": "Get the latest news, exclusives, sport, celebrities, showbiz, politics, business and lifestyle from The Sun",
-                "content": "Get the latest news, exclusives, sport, celebrities, showbiz, politics, business and lifestyle from The Sun",
-            }, ...
+            SearchHit(
+                url="https://www.thesun.co.uk/",
+                title="News, sport, celebrities and gossip | The Sun",
+                body="Get the latest news, exclusives, sport, celebrities, showbiz, politics, business and lifestyle from The Sun",
+                content="Get the latest news, exclusives, sport, celebrities, showbiz, politics, business and lifestyle from The Sun",
+            ), ...
         ]
     """
 
     try:
-        # Initialize DDGS and perform text search
+        # Initialize DDGS and perform text search. Each call gets its own instance
+        # because DDGS sleeps before any request made within 20s of its last one.
         num = 2
         ddgs = DDGS(timeout=3)
         results = ddgs.text(keywords=query, region=region, max_results=num)
         # Ensure the result is a list
         if isinstance(results, list):
-            return add_content_to_results(results, "href")
+            hits = [
+                SearchHit(
+                    url=result.get("href", ""),
+                    title=result.get("title", ""),
+                    body=result.get("body", ""),
+                )
+                for result in results
+            ]
+            return add_content_to_results(hits, scraped)
         else:
             return []
     except Exception as e:
@@ -202,26 +568,29 @@ def search_duckduckgo_text(query: str, region: str = "wt-wt") -> List:
         return []
 
 
-def search_duckduckgo_news(query: str, region: str = "wt-wt") -> list:
+def search_duckduckgo_news(
+    query: str, region: str = "wt-wt", scraped: Optional[Dict[str, Future]] = None
+) -> List[SearchHit]:
     """
     Search DuckDuckGo for results based on the given query.
 
     Args:
         query (str): The search query for DuckDuckGo.
         region(str): [Optional] : region for which to make query
+        scraped(Dict): [Optional] : request-scoped map of already scraped URLs
 
     Returns:
-        list: A list containing the search results or an empty list in case of an error or invalid output.
+        List[SearchHit]: The search results or an empty list in case of an error or invalid output.
             [
-                {
-                    "date": "2024-07-03T16:25:22+00:00",
-                    "title": "Murdoch's Sun Endorses Starmer's Labour Day Before UK Vote",
-                    "body": "Rupert Murdoch's Sun newspaper endorsed Keir Starmer and his opposition Labour Party to win the UK general election, a dramatic move in the British media landscape that illustrates the country's shifting political sands.",
-                    "url": "https://www.msn.com/en-us/money/other/murdoch-s-sun-endorses-starmer-s-labour-day-before-uk-vote/ar-BB1plQwl",
-                    "image": "https://img-s-msn-com.akamaized.net/tenant/amp/entityid/BB1plZil.img?w=2000&h=1333&m=4&q=79",
-                    "source": "Bloomberg on MSN.com",
-                    "content": "Rupert Murdoch's Sun newspaper endorsed Keir Starmer and his opposition Labour Party to win the UK general election, a dramatic move in the British media landscape that illustrates the country's shifting political sands.",
-                }, ...
+                SearchHit(
+                    url="https://www.msn.com/en-us/money/other/murdoch-s-sun-endorses-starmer-s-labour-day-before-uk-vote/ar-BB1plQwl",
+                    title="Murdoch's Sun Endorses Starmer's Labour Day Before UK Vote",
+                    body="Rupert Murdoch's Sun newspaper endorsed Keir Starmer and his opposition Labour Party to win the UK general election, a dramatic move in the British media landscape that illustrates the country's shifting political sands.",
+                    content="Rupert Murdoch's Sun newspaper endorsed Keir Starmer and his opposition Labour Party to win the UK general election, a dramatic move in the British media landscape that illustrates the country's shifting political sands.",
+                    date="2024-07-03T16:25:22+00:00",
+                    image="https://img-s-msn-com.akamaized.net/tenant/amp/entityid/BB1plZil.img?w=2000&h=1333&m=4&q=79",
+                    source="Bloomberg on MSN.com",
+                ), ...
             ]
 
     """
@@ -233,7 +602,18 @@ def search_duckduckgo_news(query: str, region: str = "wt-wt") -> list:
 
         # Ensure the result is a list
         if isinstance(results, list):
-            return add_content_to_results(results, "url")
+            hits = [
+                SearchHit(
+                    url=result.get("url", ""),
+                    title=result.get("title", ""),
+                    body=result.get("body", ""),
+                    date=result.get("date"),
+                    image=result.get("image"),
+                    source=result.get("source"),
+                )
+                for result in results
+            ]
+            return add_content_to_results(hits, scraped)
         else:
             logger.error("DDG News search returned a non-list output.")
             return []
@@ -242,7 +622,7 @@ def search_duckduckgo_news(query: str, region: str = "wt-wt") -> list:
         return []
 
 
-def search_duckduckgo_videos(query: str) -> list:
+def search_duckduckgo_videos(query: str) -> List[VideoHit]:
     """
     Search DuckDuckGo for results based on the given query.
 
@@ -251,29 +631,29 @@ def search_duckduckgo_videos(query: str) -> list:
         region(str): [Optional] : region for which to make query
 
     Returns:
-        list: A list containing the search results or an empty list in case of an error or invalid output.
+        List[VideoHit]: The video results or an empty list in case of an error or invalid output.
     """
     try:
-        # Initialize DDGS and perform news search
+        # Initialize DDGS and perform video search
         num = 5
-        ddgs_results = DDGS().videos(f"youtube: {query}", max_results=num)
+        ddgs_results = DDGS(timeout=3).videos(f"youtube: {query}", max_results=num)
         formatted_videos = []
 
         for result in ddgs_results:
             if "youtube.com" in result.get("content", ""):
                 formatted_videos.append(
-                    {
-                        "id": result["content"].split("v=")[-1],
-                        "thumbnails": [result["images"]["medium"]],
-                        "title": result["title"],
-                        "description": result.get("description"),
-                        "channel": result.get("statistics", {}).get(
+                    VideoHit(
+                        id=result["content"].split("v=")[-1],
+                        thumbnails=[result["images"]["medium"]],
+                        title=result["title"],
+                        description=result.get("description"),
+                        channel=result.get("statistics", {}).get(
                             "uploader", "YouTube"
                         ),
-                        "publish_time": result.get("published"),
-                        "link": result["content"],
-                        "source": result["publisher"],
-                    }
+                        publish_time=result.get("published"),
+                        link=result["content"],
+                        source=result["publisher"],
+                    )
                 )
 
         if isinstance(formatted_videos, list):
@@ -286,24 +666,17 @@ def search_duckduckgo_videos(query: str) -> list:
         return []
 
 
-def generate_response(message: str, search_results: Dict) -> str:
-    """Function to generating response."""
-    video_search_results = ""
-    news_search_results = ""
-    web_search_results = ""
-
-    if search_results:
-        video_search_results = exract_search_results(search_results.get("videos", []))
-        news_search_results = exract_search_results(search_results.get("news", []))
-        web_search_results = exract_search_results(search_results.get("web", []))
-
-    prompt = """
+# Static system block kept byte-identical across calls so the provider can reuse
+# its cached prefill; everything that varies per request lives in PROMPT_SUFFIX
+PROMPT_PREFIX = """
     <|begin_of_text|>  
     <|start_header_id|>system<|end_header_id|>  
     You are an helpful assistant Peter. Your role is to answer questions and provide information to the user.
     And help them acheive their goals.
     <|eot_id|>
-    
+    """
+
+PROMPT_SUFFIX = """
     <|start_header_id|>search_results<|end_header_id|>
     Video  Search Results :
     {video_search_results}
@@ -321,39 +694,149 @@ def generate_response(message: str, search_results: Dict) -> str:
     <|start_header_id|>assistant<|end_header_id|>
     """
 
-    template = PromptTemplate(
-        template=prompt,
-        input_variables=[
-            "input",
-            "video_search_results",
-            "news_search_results",
-            "web_search_results",
-        ],
+# The template is deterministic, so it is compiled once and shared by every request
+_PROMPT = PromptTemplate(
+    template=PROMPT_PREFIX + PROMPT_SUFFIX,
+    input_variables=[
+        "input",
+        "video_search_results",
+        "news_search_results",
+        "web_search_results",
+    ],
+)
+
+_CHAIN = _PROMPT | llm | StrOutputParser()
+# Fall back to the main chain if the no-search model errors, e.g. once it is retired
+_NO_SEARCH_CHAIN = (_PROMPT | no_search_llm | StrOutputParser()).with_fallbacks([_CHAIN])
+
+
+def lookup_cached_response(
+    message: str, search_results: Dict
+) -> Tuple[str, Optional[np.ndarray], Optional[str]]:
+    """Look up a response for the message in the exact and semantic caches.
+
+    Messages without search results are looked up by their normalised text in the
+    dedicated no-search cache instead of the exact cache.
+
+    Args:
+        message (str): The user message.
+        search_results (Dict): The search results supplied to the prompt.
+
+    Returns:
+        Tuple[str, Optional[np.ndarray], Optional[str]]: The exact cache key, the message
+        embedding (None with search results or if semantic caching is unavailable) and the
+        cached response, if any.
+    """
+    if search_results:
+        cache_key = response_cache_key(message, search_results)
+        cache = _RESPONSE_CACHE
+    else:
+        cache_key = no_search_cache_key(message)
+        cache = _NO_SEARCH_CACHE
+
+    cached_response = get_cached_response(cache_key, cache)
+    if cached_response is not None:
+        return cache_key, None, cached_response
+
+    # Answers built on search results are never reused for other results
+    if search_results:
+        return cache_key, None, None
+
+    # Fall back to a near-duplicate question asked without search
+    embedding = embed_message(message)
+    if embedding is not None:
+        cached_response = get_semantic_cached_response(embedding)
+        if cached_response is not None:
+            set_cached_response(cache_key, cached_response, cache)
+            return cache_key, embedding, cached_response
+
+    return cache_key, embedding, None
+
+
+def store_response(
+    cache_key: str,
+    embedding: Optional[np.ndarray],
+    search_results: Dict,
+    response: str,
+) -> None:
+    """Store a generated response in the exact and semantic caches."""
+    cache = _RESPONSE_CACHE if search_results else _NO_SEARCH_CACHE
+    set_cached_response(cache_key, response, cache)
+    if embedding is not None:
+        set_semantic_cached_response(embedding, response)
+
+
+def build_prompt_inputs(message: str, search_results: Dict) -> Dict[str, str]:
+    """Build the prompt variables for a message and its search results."""
+    video_search_results = ""
+    news_search_results = ""
+    web_search_results = ""
+
+    if search_results:
+        video_search_results = exract_search_results(search_results.get("videos", []))
+        news_search_results = exract_search_results(search_results.get("news", []))
+        web_search_results = exract_search_results(search_results.get("web", []))
+
+    return {
+        "input": message,
+        "video_search_results": video_search_results,
+        "news_search_results": news_search_results,
+        "web_search_results": web_search_results,
+    }
+
+
+async def stream_response(message: str, search_results: Dict) -> AsyncIterator[str]:
+    """Stream the response to a message chunk by chunk.
+
+    Args:
+        message (str): The user message.
+        search_results (Dict): The search results supplied to the prompt.
+
+    Yields:
+        str: Successive chunks of the response. Cached responses are yielded whole.
+    """
+    cache_key, embedding, cached_response = await asyncio.to_thread(
+        lookup_cached_response, message, search_results
     )
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    chain = _CHAIN if search_results else _NO_SEARCH_CHAIN
+    chunks = []
+    async for chunk in chain.astream(build_prompt_inputs(message, search_results)):
+        if not chunks:
+            chunk = chunk.lstrip()
+        if chunk:
+            chunks.append(chunk)
+            yield chunk
+
+    store_response(cache_key, embedding, search_results, "".join(chunks).strip())
 
-    template = template.partial(video_search_results=video_search_results)
-    template = template.partial(web_search_results=web_search_results)
-    template = template.partial(news_search_results=news_search_results)
 
-    chain = template | llm | StrOutputParser()
+async def send_payload(websocket: WebSocket, payload: Dict) -> None:
+    """Serialize a payload with orjson and send it as a text frame."""
+    await websocket.send_text(orjson.dumps(payload).decode())
 
-    response = chain.invoke(message)
 
-    return response.strip()
-    # return video_search_results
+async def receive_payload(websocket: WebSocket) -> Dict:
+    """Receive a text frame and parse it with orjson."""
+    return orjson.loads(await websocket.receive_text())
+
 
 @app.websocket("/chat")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await receive_payload(websocket)
             user_id = data.get("user_id")
             session_id = data.get("session_id")
             user_message = data.get("user_message", "")
             search = data.get("search", False)
 
-            await websocket.send_json(
+            await send_payload(
+                websocket,
                 {
                     "user_id": user_id,
                     "session_id": session_id,
@@ -364,9 +847,11 @@ async def websocket_endpoint(websocket: WebSocket):
                 }
             )
             if search:
-                await websocket.send_json(
+                await asyncio.to_thread(invalidate_no_search_response, user_message)
+                await send_payload(
+                    websocket,
                     {
-                        user_id: user_id,
+                        "user_id": user_id,
                         "session_id": session_id,
                         "chain_of_thought": False,
                         "chain_of_thought_message": "Searching for external information",
@@ -375,9 +860,23 @@ async def websocket_endpoint(websocket: WebSocket):
                     }
                 )
 
-                web_search_results = search_duckduckgo_text(user_message)
-                video_search_results = search_duckduckgo_videos(user_message)
-                news_search_results = search_duckduckgo_news(user_message)
+                # Run the blocking searches in worker threads so they overlap
+                # and do not stall the event loop for other sessions. Web and
+                # news share one scrape map so a URL in both is fetched once.
+                scraped: Dict[str, Future] = {}
+                results = await asyncio.gather(
+                    asyncio.to_thread(search_duckduckgo_text, user_message, scraped=scraped),
+                    asyncio.to_thread(search_duckduckgo_videos, user_message),
+                    asyncio.to_thread(search_duckduckgo_news, user_message, scraped=scraped),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.error(f"Search failed for '{user_message}': {result}")
+                web_search_results, video_search_results, news_search_results = [
+                    [] if isinstance(result, Exception) else result
+                    for result in results
+                ]
 
                 search_results = {
                     "web": web_search_results,
@@ -385,9 +884,10 @@ async def websocket_endpoint(websocket: WebSocket):
                     "videos": video_search_results,
                 }
 
-                await websocket.send_json(
+                await send_payload(
+                    websocket,
                     {
-                        user_id: user_id,
+                        "user_id": user_id,
                         "session_id": session_id,
                         "chain_of_thought": False,
                         "chain_of_thought_message": "Personalizing response",
@@ -398,9 +898,10 @@ async def websocket_endpoint(websocket: WebSocket):
 
             else:
                 search_results = {}
-                await websocket.send_json(
+                await send_payload(
+                    websocket,
                     {
-                        user_id: user_id,
+                        "user_id": user_id,
                         "session_id": session_id,
                         "chain_of_thought": False,
                         "chain_of_thought_message": "Personalizing response",
@@ -409,16 +910,34 @@ async def websocket_endpoint(websocket: WebSocket):
                     }
                 )
 
-            generated_message = generate_response(user_message, search_results)
+            # Push each chunk as it arrives, then the full message as the final frame.
+            # Search results already went out above and are repeated only at the end.
+            chunks = []
+            async for chunk in stream_response(user_message, search_results):
+                chunks.append(chunk)
+                await send_payload(
+                    websocket,
+                    {
+                        "user_id": user_id,
+                        "session_id": session_id,
+                        "chain_of_thought": False,
+                        "chain_of_thought_message": "Personalizing response",
+                        "message": chunk,
+                        "partial": True,
+                    }
+                )
+            generated_message = "".join(chunks).strip()
 
-            await websocket.send_json(
+            await send_payload(
+                websocket,
                 {
-                    user_id: user_id,
+                    "user_id": user_id,
                     "session_id": session_id,
                     "chain_of_thought": True,
                     "chain_of_thought_message": "",
                     "message": generated_message,
                     "search_results": search_results,
+                    "partial": False,
                 }
             )
     except WebSocketDisconnect:
@@ -427,4 +946,14 @@ async def websocket_endpoint(websocket: WebSocket):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Each worker is its own process with its own in-memory caches; the scrape
+    # cache on disk is shared between them
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        workers=os.cpu_count(),
+    )
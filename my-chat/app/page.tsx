@@ -37,6 +37,19 @@ export default function Chat() {
             !prev[prev.length - 1]?.chain_of_thought &&
             prev[prev.length - 1]?.user !== "You"
           ) {
+            const last = prev[prev.length - 1];
+            // Streamed chunks carry no search results, so keep the ones already
+            // shown, and extend the partial message instead of replacing it
+            if (data?.partial) {
+              return [
+                ...prev?.slice(0, -1),
+                {
+                  ...data,
+                  message: last?.partial ? last.message + data.message : data.message,
+                  search_results: last?.search_results,
+                },
+              ];
+            }
             return [...prev?.slice(0, -1), data];
           }
           return [...prev, data];